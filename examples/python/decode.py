@@ -16,6 +16,8 @@ def main():
             "--format=jsonl",
         ],
         stdout=subprocess.PIPE,
+        # Use a larger read buffer to reduce the number of reads on the pipe.
+        bufsize=1 << 20,
     ) as process:
         # Decode each message by using our helper module.
         for msg in message.decode(process.stdout):
@@ -1,20 +1,24 @@
 # This is a helper module that assists and in encoding/decoding JSON messages from warcat.
 import json
 import base64
+import binascii
 import io
+from typing import Union
 
 
 # Represents the Metadata message.
 class Metadata:
+    __slots__ = ("file", "position")
+
     file: str
     position: int
 
     def __init__(self, file: str, position: int):
         self.file = file
-        self.position = position
+        self.position = int(position) if isinstance(position, str) else position
 
     def deserialize(file: str, position: str):
-        return Metadata(file, int(position))
+        return Metadata(file, position)
 
     def serialize(self) -> dict:
         return {
@@ -27,12 +31,16 @@ class Metadata:
 
 # Represents the Header message.
 class Header:
+    __slots__ = ("version", "fields")
+
     version: str
-    fields: list
+    fields: tuple
 
+    # The fields are stored as a tuple of (name, value) tuples, which uses
+    # less memory than the lists produced by the JSON decoder.
     def __init__(self, version: str, fields: list):
         self.version = version
-        self.fields = fields
+        self.fields = tuple((name, value) for name, value in fields)
 
     def deserialize(version: str, fields: list):
         return Header(version, fields)
@@ -47,10 +55,14 @@ class Header:
 
 
 # Represents the BlockChunk message.
+# The data may be a memoryview, such as a slice of a larger buffer or mmap,
+# to avoid copying it.
 class BlockChunk:
-    data: bytes
+    __slots__ = ("data",)
+
+    data: Union[bytes, memoryview]
 
-    def __init__(self, data: bytes):
+    def __init__(self, data: Union[bytes, memoryview]):
         self.data = data
 
     def deserialize(data: str):
@@ -62,6 +74,8 @@ class BlockChunk:
 
 # Represents the BlockEnd message.
 class BlockEnd:
+    __slots__ = ("crc32", "crc32c", "xxh3")
+
     crc32c: int
 
     def __init__(self, crc32: int = None, crc32c: int = None, xxh3: int = None):
@@ -80,6 +94,8 @@ class BlockEnd:
 
 # Represents the EndOfFile message
 class EndOfFile:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -99,34 +115,103 @@ MESSAGE_TABLE = {
 }
 
 
-class MessageEncoder(json.JSONEncoder):
-    def default(self, o):
-        if hasattr(o, "serialize"):
-            return o.serialize()
+# Callables that build each message from its decoded JSON fields.
+# Constructors are used directly except where the fields need converting.
+_DESERIALIZE_TABLE = {**MESSAGE_TABLE, "BlockChunk": BlockChunk.deserialize}
+
+
+# Convert a decoded JSON object into a message object.
+# A message is an object with a single key naming the message type, so only
+# the single key needs to be looked up. Unknown values are returned as is.
+def _dispatch(obj):
+    if not isinstance(obj, dict) or len(obj) != 1:
+        return obj
+
+    tag = next(iter(obj))
+    deserialize = _DESERIALIZE_TABLE.get(tag)
+
+    if deserialize is None:
+        return obj
+
+    return deserialize(**obj[tag])
+
+
+# Number of bytes of block data encoded to base64 at a time.
+# This must be a multiple of 3 so that no padding is produced between pieces.
+_BASE64_PIECE_SIZE = 49152
 
-        return super().default(o)
+# The JSON text surrounding the base64 data of a compact BlockChunk message.
+_BLOCK_CHUNK_PREFIX = b'{"BlockChunk":{"data":"'
+_BLOCK_CHUNK_SUFFIX = b'"}}'
 
 
-def message_object_hook(obj: dict):
-    for k, v in MESSAGE_TABLE.items():
-        if k in obj:
-            return MESSAGE_TABLE[k].deserialize(**obj[k])
+# Write a BlockChunk message as a line of JSON to the given stream.
+# The data is encoded to base64 in pieces and written directly to the stream
+# so that a full size copy of the encoded data is not held in memory.
+def _encode_block_chunk(stream: io.BufferedIOBase, message: BlockChunk):
+    # Cast to a flat view of bytes so that slicing is by byte, not by item.
+    data = memoryview(message.data).cast("B")
 
-    return obj
+    stream.write(_BLOCK_CHUNK_PREFIX)
+
+    for index in range(0, len(data), _BASE64_PIECE_SIZE):
+        stream.write(base64.b64encode(data[index : index + _BASE64_PIECE_SIZE]))
+
+    stream.write(_BLOCK_CHUNK_SUFFIX + b"\n")
+
+
+# Decode a line containing a compact BlockChunk message without parsing it
+# as JSON. The base64 data is decoded straight from the line bytes, which
+# avoids building a str of the encoded data. Returns None if the line is not
+# in the expected form, including when the payload is not plain base64
+# (for example, it contains JSON escapes or other members).
+def _decode_block_chunk(line: bytes):
+    end = len(line)
+
+    if line.endswith(b"\n"):
+        end -= 1
+
+    if not line.endswith(_BLOCK_CHUNK_SUFFIX, len(_BLOCK_CHUNK_PREFIX), end):
+        return None
+
+    start = len(_BLOCK_CHUNK_PREFIX)
+    end -= len(_BLOCK_CHUNK_SUFFIX)
+
+    # A quote or backslash means the string has escapes or is followed by
+    # other members, so it must be parsed as JSON.
+    if line.find(b'"', start, end) >= 0 or line.find(b"\\", start, end) >= 0:
+        return None
+
+    try:
+        return BlockChunk(binascii.a2b_base64(memoryview(line)[start:end]))
+    except binascii.Error:
+        return None
 
 
 # Write a message as a line of JSON to the given stream.
+# Plain values, such as the dicts decoded for unknown messages, are written
+# as is.
 def encode(stream: io.BufferedIOBase, message):
-    data = MessageEncoder().encode(message).encode("utf8")
+    if isinstance(message, BlockChunk):
+        _encode_block_chunk(stream, message)
+        return
 
-    stream.write(data)
-    stream.write(b"\n")
+    obj = message.serialize() if hasattr(message, "serialize") else message
+    data = json.dumps(obj, separators=(",", ":")).encode("utf8")
+
+    stream.write(data + b"\n")
 
 
 # A generator that produces messages by reading lines containing JSON from
-# the given stream.
+# the given stream. Lines are read one at a time so that large exports are
+# not held in memory all at once.
 def decode(stream: io.BufferedIOBase):
-    for line in stream.readlines():
-        segment = line.decode("utf8")
+    for line in stream:
+        if line.startswith(_BLOCK_CHUNK_PREFIX):
+            message = _decode_block_chunk(line)
+
+            if message is not None:
+                yield message
+                continue
 
-        yield json.loads(segment, object_hook=message_object_hook)
+        yield _dispatch(json.loads(line))